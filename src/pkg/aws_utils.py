@@ -0,0 +1,67 @@
+"""
+AWS helpers shared by the QuickSight Governance Lambdas:
+    a. boto3 clients, created on first use to keep service model loading out
+       of the Lambda cold start, and reused afterwards.
+    b. manifest retrieval from S3, reusing the parsed manifest across warm
+       invocations while its ETag is unchanged.
+"""
+
+import json
+import logging
+import functools
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+LOGGER = logging.getLogger()
+
+DEFAULT_POOL_CONNECTIONS = 10
+
+# (bucket, key) -> {'etag': ..., 'payload': ...} of the last manifest read
+MANIFEST_CACHE = {}
+
+
+@functools.lru_cache(maxsize=None)
+def get_client(service_name, max_pool_connections=DEFAULT_POOL_CONNECTIONS):
+    """
+    Get the boto3 client for an AWS service
+    """
+    return boto3.client(
+        service_name,
+        config=Config(
+            max_pool_connections=max_pool_connections,
+            retries={'max_attempts': 10, 'mode': 'adaptive'},
+            tcp_keepalive=True,
+        ),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_resource(service_name):
+    """
+    Get the boto3 resource for an AWS service
+    """
+    return boto3.resource(service_name)
+
+
+def get_manifest_data(bucket, key):
+    """
+    Retrieve and parse a manifest file from S3. On warm invocations the
+    object is only downloaded again if its ETag has changed.
+    """
+    cached = MANIFEST_CACHE.get((bucket, key))
+    request = {'Bucket': bucket, 'Key': key}
+    if cached:
+        request['IfNoneMatch'] = cached['etag']
+
+    try:
+        data = get_client('s3').get_object(**request)
+    except ClientError as err:
+        if err.response['Error']['Code'] == '304':
+            LOGGER.info(f"Manifest s3://{bucket}/{key} unchanged, using cached copy.")
+            return cached['payload']
+        raise
+
+    json_data = json.loads(data['Body'].read())
+    MANIFEST_CACHE[(bucket, key)] = {'etag': data['ETag'], 'payload': json_data}
+    return json_data
@@ -4,11 +4,13 @@ to S3
 """
 
 import os
+import re
+import time
 import traceback
 import json
 import logging
-import boto3
 import urllib3
+from aws_utils import get_client, get_resource
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
@@ -23,25 +25,49 @@ SUCCESS_RESPONSE = {
     'body': json.dumps("Okta User Information Retrieval execution complete"),
 }
 
-# Boto3
-S3_RESOURCE = boto3.resource('s3')
-SECRETS_CLIENT = boto3.client('secretsmanager')
-
 # Environment Variables
 BUCKET = os.environ['QS_GOVERNANCE_BUCKET']
 KEY = os.environ['QS_USER_GOVERNANCE_KEY']
 OKTA_SECRET = os.environ['OKTA_SECRET']
 
-# Urllib3
-HTTP = urllib3.PoolManager()
+# Urllib3 (pooled HTTP/1.1 connections are kept alive and reused across Okta
+# pages; retry with backoff on rate limiting and transient server errors)
+HTTP = urllib3.PoolManager(
+    num_pools=2,
+    maxsize=4,
+    block=True,
+    retries=urllib3.Retry(
+        total=5, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504]
+    ),
+)
+OKTA_PAGE_LIMIT = 200
+NEXT_LINK_PATTERN = re.compile(r'<([^>]+)>;\s*rel="next"')
+
+# Okta Specific Secrets (cached across warm invocations, refreshed hourly)
+SECRET_REFRESH_INTERVAL = 3600
+SECRET_CACHE = {'expires_at': 0}
+OKTA_APP_ID = None
+OKTA_URL = None
+OKTA_AUTH = None
+
+
+def load_okta_secret():
+    """
+    Retrieve the Okta secret from Secrets Manager if the cached copy is
+    missing or older than SECRET_REFRESH_INTERVAL, parsing it exactly once
+    """
+    global OKTA_APP_ID, OKTA_URL, OKTA_AUTH
+
+    if time.monotonic() < SECRET_CACHE['expires_at']:
+        return
 
-# Okta Specific Secrets
-response = SECRETS_CLIENT.get_secret_value(SecretId=OKTA_SECRET)
-OKTA_ACCT_ID = json.loads(response['SecretString'])['okta-account-id-secret']
-OKTA_APP_ID = json.loads(response['SecretString'])['okta-app-id-secret']
-OKTA_APP_TOKEN = json.loads(response['SecretString'])['okta-app-token-secret']
-OKTA_URL = f"https://{OKTA_ACCT_ID}.okta.com/api/v1"
-OKTA_AUTH = f"SSWS {OKTA_APP_TOKEN}"
+    response = get_client('secretsmanager').get_secret_value(SecretId=OKTA_SECRET)
+    secret = json.loads(response['SecretString'])
+    OKTA_APP_ID = secret['okta-app-id-secret']
+    OKTA_URL = f"https://{secret['okta-account-id-secret']}.okta.com/api/v1"
+    OKTA_AUTH = f"SSWS {secret['okta-app-token-secret']}"
+    SECRET_CACHE['expires_at'] = time.monotonic() + SECRET_REFRESH_INTERVAL
+    LOGGER.info(f"Okta secret [{OKTA_SECRET}] loaded.")
 
 
 def handler(event, _):
@@ -54,6 +80,7 @@ def handler(event, _):
     LOGGER.info(f"event: {event}")
 
     try:
+        load_okta_secret()
         users = get_users()
         manifest = build_user_governance_manifest(users)
         upload_to_s3(manifest)
@@ -66,53 +93,70 @@ def handler(event, _):
 
 def get_users():
     """
-    Use urllib3 to make a REST call to get list of Okta
-    Users for a given Okta Application
+    Use urllib3 to make REST calls to get the Okta Users for a given Okta
+    Application, following pagination until every user has been yielded
     """
-    request_url = f"{OKTA_URL}/apps/{OKTA_APP_ID}/users"
-    okta_users_request = HTTP.request(
-        'GET',
-        request_url,
-        headers={'Content-Type': 'application/json', 'Authorization': OKTA_AUTH},
-        retries=False,
-    )
+    request_url = f"{OKTA_URL}/apps/{OKTA_APP_ID}/users?limit={OKTA_PAGE_LIMIT}"
+    yield from get_paginated_items(request_url)
     LOGGER.info(f"Retrieved Okta Users Information from {request_url}")
-    users = json.loads(okta_users_request.data.decode('utf-8'))
-    return users
 
 
 def get_users_groups(okta_user_id):
     """
-    Use urllib3 to make a REST call to get list of Okta
+    Use urllib3 to make REST calls to get list of Okta
     Users Groups Memberships from a specific okta user id
     """
-    request_url = f"{OKTA_URL}/users/{okta_user_id}/groups"
-    group_memberships_request = HTTP.request(
-        'GET',
-        request_url,
-        headers={'Content-Type': 'application/json', 'Authorization': OKTA_AUTH},
-        retries=False,
-    )
+    request_url = f"{OKTA_URL}/users/{okta_user_id}/groups?limit={OKTA_PAGE_LIMIT}"
+    group_memberships = list(get_paginated_items(request_url))
     LOGGER.info(f"Retrieved Okta Users Groups Memberships from {request_url}")
-    group_memberships = json.loads(group_memberships_request.data.decode('utf-8'))
     return group_memberships
 
 
+def get_paginated_items(request_url):
+    """
+    Yield every item of an Okta list endpoint, one page at a time. Okta
+    returns the url of the next page in the `Link: <url>; rel="next"` header.
+    """
+    next_url = request_url
+    while next_url:
+        page_request = HTTP.request(
+            'GET',
+            next_url,
+            headers={'Content-Type': 'application/json', 'Authorization': OKTA_AUTH},
+        )
+        yield from json.loads(page_request.data)
+        next_url = get_next_link(page_request.headers.getlist('Link'))
+
+
+def get_next_link(link_headers):
+    """
+    Extract the rel="next" url from a list of Okta Link headers, if any
+    """
+    for link in link_headers:
+        match = NEXT_LINK_PATTERN.search(link)
+        if match:
+            return match.group(1)
+    return None
+
+
 def build_user_governance_manifest(users):
     """
-    Build QuickSight Users manifest from the HTTP Request json
+    Build QuickSight Users manifest from the Okta users as they are retrieved
     """
     user_manifest = {"users": []}
     for usr in users:
-        groups = []
-        group_memberships = get_users_groups(usr['id'])
-        for grp in group_memberships:
-            groups.append(grp['profile']['name'])
+        credentials = usr.get('credentials') or {}
+        if 'userName' not in credentials:
+            LOGGER.info(f"Okta user [{usr.get('id')}] has no userName credential, skipping.")
+            continue
+
+        username = credentials['userName']
+        groups = [grp['profile']['name'] for grp in get_users_groups(usr['id'])]
 
         user_manifest['users'].append(
             {
-                "username": usr['credentials']['userName'],
-                "email": usr['credentials']['userName'],
+                "username": username,
+                "email": username,
                 "groups": groups,
             }
         )
@@ -125,6 +169,6 @@ def upload_to_s3(json_data):
     """
     upload json data to an S3 object
     """
-    s3object = S3_RESOURCE.Object(BUCKET, KEY)
-    s3object.put(Body=(bytes(json.dumps(json_data).encode('UTF-8'))))
+    s3object = get_resource('s3').Object(BUCKET, KEY)
+    s3object.put(Body=json.dumps(json_data, separators=(',', ':')).encode('utf-8'))
     LOGGER.info(f"Manifest uploaded to s3://{BUCKET}/{KEY}")
@@ -34,12 +34,13 @@ Sample Asset Governance Manifest File:
 """
 
 import os
+import functools
 import traceback
 import json
 import logging
 from dataclasses import dataclass
-import boto3
 from botocore.exceptions import ClientError
+from aws_utils import get_client, get_manifest_data
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
@@ -55,9 +56,7 @@ SUCCESS_RESPONSE = {
 }
 
 # Boto3
-QS_CLIENT = boto3.client('quicksight')
-S3_CLIENT = boto3.client('s3')
-REGION = QS_CLIENT.meta.region_name
+get_qs_client = functools.partial(get_client, 'quicksight')
 
 # Environment Variables
 BUCKET = os.environ['QS_GOVERNANCE_BUCKET']
@@ -80,6 +79,8 @@ class QuickSightAsset:
     and its permission assignments
     """
 
+    __slots__ = ('name', 'category', 'namespace', 'groups', 'permission', 'account_id')
+
     name: str
     category: str
     namespace: str
@@ -99,13 +100,19 @@ def handler(event, context):
     LOGGER.info(f"event: {event}")
 
     account_id = context.invoked_function_arn.split(":")[4]
-    all_datasets = get_all_datasets(account_id)
     manifest = get_asset_manifest(account_id)
+    if not manifest:
+        LOGGER.info("No assets to govern.")
+        return SUCCESS_RESPONSE
+    dataset_ids = get_dataset_ids(account_id)
 
     try:
         for asset in manifest:
             if asset.category == "dataset":
-                dataset_id = get_dataset_id(asset, all_datasets)
+                dataset_id = dataset_ids.get(asset.name)
+                if dataset_id is None:
+                    LOGGER.info(f"Dataset [{asset.name}] not found in QuickSight, skipping.")
+                    continue
                 reset_dataset_permissions(asset, dataset_id)
                 apply_dataset_governance(asset, dataset_id)
             # elif asset.category == "dashboard":
@@ -130,11 +137,11 @@ def get_all_datasets(account_id):
     dataset in the QuickSight account.
     """
     all_datasets = []
-    response = QS_CLIENT.list_data_sets(AwsAccountId=account_id)
+    response = get_qs_client().list_data_sets(AwsAccountId=account_id)
     for dset in response['DataSetSummaries']:
         all_datasets.append(dset)
     while response.get("NextToken", None) is not None:
-        response = QS_CLIENT.list_data_sets(
+        response = get_qs_client().list_data_sets(
             AwsAccountId=account_id, NextToken=response.get("NextToken")
         )
         for dset in response['DataSetSummaries']:
@@ -142,20 +149,32 @@ def get_all_datasets(account_id):
     return all_datasets
 
 
+def get_dataset_ids(account_id):
+    """
+    Map every DataSet Name to its DataSetID. Names are not unique in
+    QuickSight; the first dataset listed with a name is used.
+    """
+    dataset_ids = {}
+    for dset in get_all_datasets(account_id):
+        if dataset_ids.setdefault(dset['Name'], dset['DataSetId']) != dset['DataSetId']:
+            LOGGER.warning(
+                f"Dataset name [{dset['Name']}] is not unique, ignoring DataSetId "
+                f"[{dset['DataSetId']}] in favor of [{dataset_ids[dset['Name']]}]"
+            )
+    return dataset_ids
+
+
 def get_asset_manifest(account_id):
     """
     Retrieve manifest file and generate list of asset objects
     """
-    assets = {}
+    assets = []
     try:
-        data = S3_CLIENT.get_object(Bucket=BUCKET, Key=KEY)
-        json_data = json.loads(data['Body'].read().decode('utf-8'))
+        json_data = get_manifest_data(BUCKET, KEY)
         assets = json_data['assets']
-        for asset in assets:
-            asset['account_id'] = account_id
     except ClientError as err:
         LOGGER.info(f"Could not retrieve manifest file. Error: {str(err)}")
-    return [QuickSightAsset(**asset) for asset in assets]
+    return [QuickSightAsset(**asset, account_id=account_id) for asset in assets]
 
 
 def apply_dataset_governance(asset, dataset_id):
@@ -168,13 +187,14 @@ def apply_dataset_governance(asset, dataset_id):
     if asset.permission == "READ":
         actions = READ_ACTIONS
 
+    region = get_qs_client().meta.region_name
     for group in asset.groups:
         principal = (
-            f"arn:aws:quicksight:{REGION}:{asset.account_id}:group/" f"{asset.namespace}/{group}"
+            f"arn:aws:quicksight:{region}:{asset.account_id}:group/" f"{asset.namespace}/{group}"
         )
 
         try:
-            QS_CLIENT.update_data_set_permissions(
+            get_qs_client().update_data_set_permissions(
                 AwsAccountId=asset.account_id,
                 DataSetId=dataset_id,
                 GrantPermissions=[
@@ -201,7 +221,7 @@ def reset_dataset_permissions(asset, dataset_id):
     Revoke all permissions assigned to a specific dataset.
     """
 
-    response = QS_CLIENT.describe_data_set_permissions(
+    response = get_qs_client().describe_data_set_permissions(
         AwsAccountId=asset.account_id, DataSetId=dataset_id
     )
     permissions = response['Permissions']
@@ -211,7 +231,7 @@ def reset_dataset_permissions(asset, dataset_id):
         actions = permission['Actions']
         if "group" in principal:
             try:
-                QS_CLIENT.update_data_set_permissions(
+                get_qs_client().update_data_set_permissions(
                     AwsAccountId=asset.account_id,
                     DataSetId=dataset_id,
                     RevokePermissions=[
@@ -227,15 +247,3 @@ def reset_dataset_permissions(asset, dataset_id):
                         "QuickSight."
                     )
     LOGGER.info(f"Permissions reset for [{asset.category}] [{asset.name}]")
-
-
-def get_dataset_id(asset: QuickSightAsset, all_datasets: dict):
-    """
-    Get the DataSetID based on a DataSet Name
-    """
-    ds_id = ''
-    for dset in all_datasets:
-        if dset['Name'] == asset.name:
-            ds_id = dset['DataSetId']
-            break
-    return ds_id
@@ -35,13 +35,17 @@ Sample User Governance Manifest File:
 """
 
 import os
+import functools
 import traceback
 import time
 import json
 import logging
-from dataclasses import dataclass, field
-import boto3
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from botocore.exceptions import ClientError
+from aws_utils import get_client, get_manifest_data
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
@@ -56,9 +60,16 @@ SUCCESS_RESPONSE = {
     'body': json.dumps('QuickSight User Governance execution complete'),
 }
 
-# Boto3 Clients
-QS_CLIENT = boto3.client('quicksight')
-S3_CLIENT = boto3.client('s3')
+# Number of users governed concurrently, and of concurrent membership
+# changes per user. Kept low to stay under the QuickSight API rate limits.
+MAX_WORKERS = 16
+MAX_MEMBERSHIP_WORKERS = 2
+
+# Boto3 Clients (one pooled QuickSight connection per concurrent request, so
+# workers never wait on a free connection)
+get_qs_client = functools.partial(
+    get_client, 'quicksight', max_pool_connections=MAX_WORKERS * MAX_MEMBERSHIP_WORKERS
+)
 
 # Environment Variables
 OKTA_ROLE_NAME = os.environ['OKTA_ROLE_NAME']
@@ -69,6 +80,23 @@ QS_ADMIN_OKTA_GROUP = os.environ['QS_ADMIN_OKTA_GROUP']
 QS_AUTHOR_OKTA_GROUP = os.environ['QS_AUTHOR_OKTA_GROUP']
 QS_READER_OKTA_GROUP = os.environ['QS_READER_OKTA_GROUP']
 
+# QuickSight user names of federated users are "<role name>/<session name>"
+QS_USERNAME_PREFIX = f"{OKTA_ROLE_NAME}/"
+
+# Namespace creation polling, in seconds
+NAMESPACE_POLL_INITIAL_DELAY = 2
+NAMESPACE_POLL_MAX_DELAY = 30
+NAMESPACE_WAIT_TIMEOUT = 120
+
+# QuickSight users/groups/memberships per namespace, listed once per
+# invocation so existence checks do not need a describe_* call per user
+EXISTING_USERS = {}
+EXISTING_GROUPS = {}
+EXISTING_MEMBERSHIPS = {}
+GROUPS_LOCK = threading.Lock()
+# (namespace, group) -> Event set once the worker creating the group is done
+PENDING_GROUPS = {}
+
 
 @dataclass
 class OktaUser:
@@ -77,18 +105,28 @@ class OktaUser:
     to a QuickSight User and its permission assignments
     """
 
+    # dataclass(slots=True) needs Python 3.10. The derived qs_* attributes are
+    # plain slots set in __post_init__, as init=False fields would clash.
+    __slots__ = (
+        'username',
+        'email',
+        'groups',
+        'account_id',
+        'namespace',
+        'qs_username',
+        'qs_groups',
+        'qs_role',
+    )
+
     username: str
     email: str
     groups: []
     account_id: str
     namespace: str
-    qs_username: str = field(init=False)
-    qs_groups: [str] = field(init=False)
-    qs_role: str = field(init=False)
 
     def __post_init__(self):
-        self.qs_username = f"{OKTA_ROLE_NAME}/{self.username}"
-        self.qs_groups = [grp for grp in self.groups if grp.startswith(QS_PREFIX)]
+        self.qs_username = QS_USERNAME_PREFIX + self.username
+        self.qs_groups = frozenset(grp for grp in self.groups if grp.startswith(QS_PREFIX))
 
         if QS_ADMIN_OKTA_GROUP in self.qs_groups:
             self.qs_role = "ADMIN"
@@ -110,10 +148,22 @@ def handler(event, context):
 
     account_id = context.invoked_function_arn.split(":")[4]
     manifest = get_user_manifest(account_id)
+    if not manifest:
+        LOGGER.info("No users to govern.")
+        return SUCCESS_RESPONSE
 
     try:
-        for user in manifest:
-            apply_user_governance(user)
+        namespaces = {user.namespace for user in manifest}
+        existing_namespaces = {
+            nspace['Name']
+            for nspace in list_all('list_namespaces', 'Namespaces', AwsAccountId=account_id)
+        }
+        for namespace in namespaces:
+            create_if_not_exists_namespace(account_id, namespace, existing_namespaces)
+            load_existing_principals(account_id, namespace)
+
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            list(executor.map(apply_user_governance, manifest))
         return SUCCESS_RESPONSE
     except Exception as err:
         LOGGER.error(traceback.format_exc())
@@ -124,23 +174,18 @@ def get_user_manifest(account_id):
     """
     Retrieve manifest file and create json object full of okta user information
     """
-    users = {}
+    users = []
     try:
-        data = S3_CLIENT.get_object(Bucket=BUCKET, Key=KEY)
-        json_data = json.loads(data['Body'].read().decode('utf-8'))
+        json_data = get_manifest_data(BUCKET, KEY)
         users = json_data["users"]
-        for user in users:
-            user['account_id'] = account_id
-            user['namespace'] = "default"
     except ClientError as err:
         LOGGER.info(f"Could not retrieve manifest file. Error: {str(err)}")
-    return [OktaUser(**user) for user in users]
+    return [OktaUser(**user, account_id=account_id, namespace="default") for user in users]
 
 
 def apply_user_governance(user):
     """
-    - Add/Update users in QuickSight.
-        - if the namespace does not exist, create it
+    - Add/Update users in QuickSight. The user's namespace must already exist.
         - if user does not exist, register the user
         - update the user role.
         - if user role was downgraded - exit.
@@ -149,8 +194,6 @@ def apply_user_governance(user):
         - assign user to its groups
     """
 
-    create_if_not_exists_namespace(user)
-
     register_if_not_exists_user(user)
 
     if update_role(user):
@@ -159,20 +202,93 @@ def apply_user_governance(user):
             update_memberships(user)
 
 
-def create_if_not_exists_namespace(user):
+def list_all(operation, result_key, **kwargs):
+    """
+    Paginate through a QuickSight list_* operation and return every item
+    found under result_key.
+    """
+    list_operation = getattr(get_qs_client(), operation)
+    response = list_operation(**kwargs)
+    items = response[result_key]
+    while response.get("NextToken", None) is not None:
+        response = list_operation(**kwargs, NextToken=response.get("NextToken"))
+        items.extend(response[result_key])
+    return items
+
+
+def load_existing_principals(account_id, namespace):
+    """
+    List every user, group and group membership of a QuickSight namespace
+    once, so that per-user checks are set lookups instead of API calls.
+    Group memberships are listed concurrently, one group per worker.
+    """
+    EXISTING_USERS[namespace] = {
+        usr['UserName']
+        for usr in list_all(
+            'list_users', 'UserList', AwsAccountId=account_id, Namespace=namespace
+        )
+    }
+    EXISTING_GROUPS[namespace] = {
+        grp['GroupName']
+        for grp in list_all(
+            'list_groups', 'GroupList', AwsAccountId=account_id, Namespace=namespace
+        )
+    }
+    groups = list(EXISTING_GROUPS[namespace])
+    memberships = defaultdict(set)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        group_members = executor.map(
+            lambda grp: list_all(
+                'list_group_memberships',
+                'GroupMemberList',
+                GroupName=grp,
+                AwsAccountId=account_id,
+                Namespace=namespace,
+            ),
+            groups,
+        )
+        for grp, members in zip(groups, group_members):
+            for member in members:
+                memberships[member['MemberName']].add(grp)
+    EXISTING_MEMBERSHIPS[namespace] = memberships
+
+
+def create_if_not_exists_namespace(account_id, namespace, existing_namespaces):
     """
     check to see if a namespace exists in a QuickSight Account.
     If not, create it.
     """
 
-    try:
-        QS_CLIENT.describe_namespace(AwsAccountId=user.account_id, Namespace=user.namespace)
-    except ClientError:
-        QS_CLIENT.create_namespace(
-            AwsAccountId=user.account_id, Namespace=user.namespace, IdentityStore='QUICKSIGHT'
+    if namespace not in existing_namespaces:
+        get_qs_client().create_namespace(
+            AwsAccountId=account_id, Namespace=namespace, IdentityStore='QUICKSIGHT'
+        )
+        status = wait_for_namespace(account_id, namespace)
+        if status != 'CREATED':
+            LOGGER.error(f"Namespace [{namespace}] was not created, status [{status}].")
+            raise Exception(f"Namespace [{namespace}] creation status: {status}")
+        LOGGER.info(f"Namespace [{namespace}] created.")
+
+
+def wait_for_namespace(account_id, namespace):
+    """
+    Poll a new namespace with exponential backoff until QuickSight finishes
+    creating it, giving up after NAMESPACE_WAIT_TIMEOUT seconds. Returns the
+    last CreationStatus seen.
+    """
+
+    delay = NAMESPACE_POLL_INITIAL_DELAY
+    deadline = time.monotonic() + NAMESPACE_WAIT_TIMEOUT
+    while True:
+        response = get_qs_client().describe_namespace(
+            AwsAccountId=account_id, Namespace=namespace
         )
-        time.sleep(120)
-        LOGGER.info(f"Namespace [{user.namespace}] created.")
+        status = response['Namespace']['CreationStatus']
+        remaining = deadline - time.monotonic()
+        if status in ('CREATED', 'NON_RETRYABLE_FAILURE') or remaining <= 0:
+            return status
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, NAMESPACE_POLL_MAX_DELAY)
 
 
 def register_if_not_exists_user(user):
@@ -181,24 +297,18 @@ def register_if_not_exists_user(user):
     If not, register it.
     """
 
-    try:
-        QS_CLIENT.describe_user(
-            UserName=user.qs_username,
+    if user.qs_username not in EXISTING_USERS[user.namespace] and user.qs_role:
+        get_qs_client().register_user(
+            IdentityType='IAM',
+            Email=user.email,
+            UserRole=user.qs_role,
+            IamArn=f'arn:aws:iam::{user.account_id}:role/{OKTA_ROLE_NAME}',
+            SessionName=user.email,
             AwsAccountId=user.account_id,
             Namespace=user.namespace,
         )
-    except ClientError:
-        if user.qs_role:
-            QS_CLIENT.register_user(
-                IdentityType='IAM',
-                Email=user.email,
-                UserRole=user.qs_role,
-                IamArn=f'arn:aws:iam::{user.account_id}:role/{OKTA_ROLE_NAME}',
-                SessionName=user.email,
-                AwsAccountId=user.account_id,
-                Namespace=user.namespace,
-            )
-            LOGGER.info(f"[{user.qs_username}] added to Namespace [{user.namespace}].")
+        EXISTING_USERS[user.namespace].add(user.qs_username)
+        LOGGER.info(f"[{user.qs_username}] added to Namespace [{user.namespace}].")
 
 
 def delete_user(user):
@@ -206,11 +316,12 @@ def delete_user(user):
     Remove the user from QuickSight
     """
 
-    QS_CLIENT.delete_user(
+    get_qs_client().delete_user(
         UserName=user.qs_username,
         AwsAccountId=user.account_id,
         Namespace=user.namespace,
     )
+    EXISTING_USERS[user.namespace].discard(user.qs_username)
     LOGGER.info(f"[{user.qs_username}] deleted.")
 
 
@@ -221,8 +332,15 @@ def update_role(user):
     """
     updated = False
 
+    if user.qs_username not in EXISTING_USERS[user.namespace]:
+        return updated
+
+    if not user.qs_role:
+        delete_user(user)
+        return updated
+
     try:
-        QS_CLIENT.update_user(
+        get_qs_client().update_user(
             UserName=user.qs_username,
             AwsAccountId=user.account_id,
             Namespace=user.namespace,
@@ -232,6 +350,7 @@ def update_role(user):
         LOGGER.info(f"[{user.qs_username}] role set to: {user.qs_role}")
         updated = True
     except ClientError as err:
+        # QuickSight rejects role downgrades (e.g. AUTHOR to READER)
         if (
                 err.response['Error']['Code'] == 'ResourceNotFoundException'
                 or err.response['Error']['Code'] == 'InvalidParameterValueException'
@@ -248,63 +367,91 @@ def create_if_not_exists_groups(user):
     ex. dlp_qs_dev_
     """
 
+    existing_groups = EXISTING_GROUPS[user.namespace]
     for grp in user.qs_groups:
+        # reserve the group under the lock; only the reserving worker creates it
+        # and the others wait for that group alone
+        with GROUPS_LOCK:
+            pending = PENDING_GROUPS.get((user.namespace, grp))
+            if pending is None:
+                if grp in existing_groups:
+                    continue
+                existing_groups.add(grp)
+                created = PENDING_GROUPS[(user.namespace, grp)] = threading.Event()
+
+        if pending is not None:
+            pending.wait()
+            continue
+
         try:
-            QS_CLIENT.describe_group(
-                GroupName=grp, AwsAccountId=user.account_id, Namespace=user.namespace
-            )
-        except ClientError:
+            create_group(user, grp)
+        finally:
+            created.set()
+            with GROUPS_LOCK:
+                del PENDING_GROUPS[(user.namespace, grp)]
 
-            QS_CLIENT.create_group(
-                GroupName=grp, AwsAccountId=user.account_id, Namespace=user.namespace
-            )
-            time.sleep(3) # let group be created
-            LOGGER.info(f"Group [{grp}] added to namespace [{user.namespace}]")
 
+def create_group(user, grp):
+    """
+    Create a QuickSight group. A group created meanwhile by a concurrent
+    invocation counts as already existing.
+    """
 
-def get_memberships(user):
+    try:
+        get_qs_client().create_group(
+            GroupName=grp, AwsAccountId=user.account_id, Namespace=user.namespace
+        )
+    except ClientError as err:
+        if err.response['Error']['Code'] != 'ResourceExistsException':
+            raise
+        return
+    time.sleep(3) # let group be created
+    LOGGER.info(f"Group [{grp}] added to namespace [{user.namespace}]")
+
+
+def update_memberships(user):
     """
-    get list of current qs users groups
+    Assign a user to its new groups and remove the user from groups it no
+    longer belongs to. Membership changes for the user are issued concurrently.
     """
 
-    memberships = []
+    current_memberships = EXISTING_MEMBERSHIPS[user.namespace].get(user.qs_username, set())
 
-    list_users_response = QS_CLIENT.list_user_groups(
-        UserName=user.qs_username,
+    with ThreadPoolExecutor(max_workers=MAX_MEMBERSHIP_WORKERS) as executor:
+        futures = [
+            executor.submit(add_membership, user, grp)
+            for grp in user.qs_groups - current_memberships
+        ] + [
+            executor.submit(remove_membership, user, grp)
+            for grp in current_memberships - user.qs_groups
+        ]
+        for future in futures:
+            future.result()
+
+
+def add_membership(user, grp):
+    """
+    Assign a user to a group
+    """
+
+    get_qs_client().create_group_membership(
+        MemberName=user.qs_username,
+        GroupName=grp,
         AwsAccountId=user.account_id,
         Namespace=user.namespace,
     )
+    LOGGER.info(f"[{user.qs_username}] assigned to Group [{grp}].")
 
-    for grp in list_users_response['GroupList']:
-        memberships.append(grp['GroupName'])
 
-    return memberships
-
-
-def update_memberships(user):
+def remove_membership(user, grp):
     """
-    Assign a user to its new groups and remove the user from groups it no
-    longer belongs to.
+    Remove a user from a group
     """
 
-    current_memberships = get_memberships(user)
-    # assign user to new groups
-    for grp in user.qs_groups:
-        if grp not in current_memberships:
-            QS_CLIENT.create_group_membership(
-                MemberName=user.qs_username,
-                GroupName=grp,
-                AwsAccountId=user.account_id,
-                Namespace=user.namespace,
-            )
-            LOGGER.info(f"[{user.qs_username}] assigned to Group [{grp}].")
-    # remove user from old groups
-    for grp in current_memberships:
-        if grp not in user.qs_groups:
-            QS_CLIENT.delete_group_membership(
-                MemberName=user.qs_username,
-                GroupName=grp,
-                AwsAccountId=user.account_id,
-                Namespace=user.namespace,
-            )
-            LOGGER.info(f"[{user.qs_username}] removed from Group [{grp}].")
+    get_qs_client().delete_group_membership(
+        MemberName=user.qs_username,
+        GroupName=grp,
+        AwsAccountId=user.account_id,
+        Namespace=user.namespace,
+    )
+    LOGGER.info(f"[{user.qs_username}] removed from Group [{grp}].")